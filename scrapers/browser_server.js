@@ -0,0 +1,25 @@
+#!/usr/bin/env node
+/**
+ * Keep one headless Chromium running for the scrapers to attach to.
+ *
+ * Usage: node scrapers/browser_server.js
+ * Then run scrapers with BROWSER_WS_ENDPOINT set to the printed endpoint.
+ */
+
+const puppeteer = require('puppeteer');
+const { LAUNCH_OPTIONS } = require('./lib/browser');
+
+async function main() {
+  const browser = await puppeteer.launch(LAUNCH_OPTIONS);
+  console.log(`BROWSER_WS_ENDPOINT=${browser.wsEndpoint()}`);
+
+  // Scrapers only disconnect, so this process owns Chromium's lifetime
+  const shutdown = async () => {
+    await browser.close();
+    process.exit(0);
+  };
+  process.on('SIGINT', shutdown);
+  process.on('SIGTERM', shutdown);
+}
+
+main().catch(console.error);
@@ -3,195 +3,239 @@
  * Collect 30 Southlake permits with full contractor details
  */
 
-const puppeteer = require('puppeteer');
 const fs = require('fs');
 
-const DEEPSEEK_API_KEY = process.env.DEEPSEEK_API_KEY;
-
-async function callDeepSeek(prompt, maxTokens = 4000) {
-  const response = await fetch('https://api.deepseek.com/v1/chat/completions', {
-    method: 'POST',
-    headers: {
-      'Content-Type': 'application/json',
-      'Authorization': `Bearer ${DEEPSEEK_API_KEY}`
-    },
-    body: JSON.stringify({
-      model: 'deepseek-chat',
-      messages: [{ role: 'user', content: prompt }],
-      temperature: 0.1,
-      max_tokens: maxTokens
-    })
-  });
-  const data = await response.json();
-  return data.choices[0].message.content;
+const { callDeepSeek, cleanHTML, extractJSON } = require('./lib/deepseek');
+const {
+  getBrowser,
+  closeBrowser,
+  DEBUG_DUMP,
+  dumpDebugHTML,
+  blockHeavyResources,
+  waitForElement,
+  gotoWithRetry,
+  afterResultsChange,
+  resultsHTML
+} = require('./lib/browser');
+const {
+  RESULTS_SELECTOR,
+  DETAIL_VIEW_SELECTOR,
+  FINAL_DATE_SORT,
+  applySort,
+  findEnerGovPageLink,
+  readPermitLinks,
+  waitForPermitDetail
+} = require('./lib/energov');
+const { isNewPermit } = require('./lib/permits');
+
+// Per-page cap on detail HTML (first 100000 chars)
+const MAX_DETAIL_HTML = 100000;
+
+// Character budget for the HTML portion of a single extraction prompt
+const MAX_PROMPT_HTML = 150000;
+
+// Upper bound on detail pages per call so the output stays within max_tokens
+const MAX_DETAILS_PER_BATCH = 3;
+
+// Whether html can join batch without exceeding the prompt budget
+function fitsBatch(batch, html) {
+  const size = batch.reduce((total, d) => total + d.html.length, 0);
+  return size + html.length <= MAX_PROMPT_HTML;
 }
 
-function cleanHTML(html) {
-  let cleaned = html.replace(/<style[^>]*>[\s\S]*?<\/style>/gi, '');
-  cleaned = cleaned.replace(/<script[^>]*>[\s\S]*?<\/script>/gi, '');
-  cleaned = cleaned.replace(/<!--[\s\S]*?-->/g, '');
-  cleaned = cleaned.replace(/<svg[^>]*>[\s\S]*?<\/svg>/gi, '');
-  cleaned = cleaned.replace(/\s+/g, ' ');
-  return cleaned;
+// Fixed prompt prefix; the detail HTML is appended per call so the prefix stays byte-identical
+const DETAIL_PROMPT = `Extract permit details from these permit detail pages.
+
+The pages follow, each wrapped in <PERMIT n>...</PERMIT n> tags. Return one entry per page, with permit_id copied exactly as shown on that page. Return JSON:
+{
+  "permits": [
+    {
+      "permit_id": "...",
+      "address": "...",
+      "type": "...",
+      "status": "...",
+      "applied_date": "...",
+      "issued_date": "...",
+      "finalized_date": "...",
+      "description": "...",
+      "valuation": "...",
+      "contractor": {
+        "company": "...",
+        "contact_name": "...",
+        "type": "Applicant/Contractor/etc"
+      }
+    }
+  ]
 }
 
-function extractJSON(text) {
+Look for Contacts table with aria-label attributes like "Company ...", "First Name ...", "Last Name ...".
+The contractor is usually Type="Applicant" or "Contractor".
+
+HTML:
+`;
+
+// Permit numbers compared loosely, since the model may change case or spacing
+function permitKey(permitId) {
+  return String(permitId ?? '').replace(/[^A-Za-z0-9]/g, '').toUpperCase();
+}
+
+// Extract several detail pages with one DeepSeek call, pairing each reply with
+// its permit by permit number (a lone page takes a lone reply as is). Permits
+// missing from the reply are retried on their own; if the call fails outright
+// the batch is halved and retried. Resolves to [{ permit, details }] in batch
+// order. A permit whose number couldn't be read is always sent on its own.
+async function extractDetailBatch(batch) {
+  const pagesText = batch
+    .map((d, i) => `<PERMIT ${i + 1}>\n${d.html}\n</PERMIT ${i + 1}>`)
+    .join('\n\n');
+
+  let data = null;
   try {
-    return JSON.parse(text);
+    data = extractJSON(await callDeepSeek(DETAIL_PROMPT + pagesText, 2000 * batch.length));
   } catch (e) {
-    const jsonMatch = text.match(/```(?:json)?\s*([\s\S]*?)```/);
-    if (jsonMatch) {
-      try { return JSON.parse(jsonMatch[1].trim()); } catch (e2) {}
-    }
-    const objMatch = text.match(/\{[\s\S]*\}/);
-    if (objMatch) {
-      try { return JSON.parse(objMatch[0]); } catch (e3) {}
-    }
-    return null;
+    console.log(`    DeepSeek call failed for ${batch.map(d => d.permit.permit_id).join(', ')}: ${e.message}`);
+  }
+
+  const entries = Array.isArray(data?.permits) ? data.permits : [];
+  const byId = new Map(entries.map(entry => [permitKey(entry?.permit_id), entry]));
+  const details = batch.map(d => {
+    if (batch.length === 1 && entries.length === 1) return entries[0];
+    return byId.get(permitKey(d.permit.permit_id)) || null;
+  });
+  const missed = batch.filter((d, i) => !details[i]);
+  if (batch.length === 1 || missed.length === 0) {
+    return batch.map((d, i) => ({ permit: d.permit, details: details[i] }));
+  }
+
+  let retried;
+  if (missed.length < batch.length) {
+    console.log(`    ${missed.length} of ${batch.length} permits missing from reply, retrying them...`);
+    retried = await extractDetailBatch(missed);
+  } else {
+    console.log(`    Batch of ${batch.length} failed, splitting...`);
+    const mid = Math.ceil(batch.length / 2);
+    retried = [
+      ...await extractDetailBatch(batch.slice(0, mid)),
+      ...await extractDetailBatch(batch.slice(mid))
+    ];
   }
+  const retriedDetails = new Map(retried.map(r => [r.permit, r.details]));
+  return batch.map((d, i) => ({ permit: d.permit, details: details[i] || retriedDetails.get(d.permit) || null }));
 }
 
 async function main() {
   console.log('Southlake 30 Permit Collector');
   console.log('=============================\n');
 
-  const browser = await puppeteer.launch({
-    headless: 'new',
-    args: ['--no-sandbox', '--disable-setuid-sandbox']
-  });
+  const browser = await getBrowser();
 
   const page = await browser.newPage();
+  await blockHeavyResources(page);
   await page.setViewport({ width: 1280, height: 900 });
 
+  // Detail pages open in their own tab so the search tab keeps its sorted
+  // results and current page between permits
+  const detailPage = await browser.newPage();
+  await blockHeavyResources(detailPage);
+  await detailPage.setViewport({ width: 1280, height: 900 });
+
   const allPermits = [];
+  const seen = new Set();
 
   try {
     // Load search page
     console.log('Loading Southlake permit search...');
-    await page.goto('https://energov.cityofsouthlake.com/EnerGov_Prod/SelfService#/search?m=2&ps=10&pn=1&em=true',
-      { waitUntil: 'networkidle2', timeout: 60000 });
-    await new Promise(r => setTimeout(r, 5000));
+    await gotoWithRetry(page, 'https://energov.cityofsouthlake.com/EnerGov_Prod/SelfService#/search?m=2&ps=10&pn=1&em=true',
+      { waitUntil: 'domcontentloaded', timeout: 30000 });
+    await waitForElement(page, '#button-Search');
 
     // Click search
     console.log('Clicking search...');
     const searchBtn = await page.$('#button-Search');
     if (searchBtn) await searchBtn.click();
-    await new Promise(r => setTimeout(r, 5000));
+    await waitForElement(page, RESULTS_SELECTOR);
 
     // Sort by Finalized Date Descending
     console.log('Sorting by Finalized Date (Descending)...');
-    await page.select('#PermitCriteria_SortBy', 'string:FinalDate');
-    await new Promise(r => setTimeout(r, 1000));
-    await page.select('#SortAscending', 'boolean:false');
-    await new Promise(r => setTimeout(r, 4000));
+    await afterResultsChange(page, RESULTS_SELECTOR,
+      () => page.evaluate(applySort, FINAL_DATE_SORT), 4000);
 
-    // Save debug HTML
-    fs.writeFileSync('debug_html/collect_page1.html', await page.content());
-    console.log('Saved debug HTML');
+    if (DEBUG_DUMP) dumpDebugHTML('collect_page1.html', await page.content());
 
     // Collect permits from 3 pages (10 per page = 30)
     for (let pageNum = 1; pageNum <= 3; pageNum++) {
       console.log(`\n--- Page ${pageNum} ---`);
 
       // Get permit links from current page
-      const permitLinks = await page.evaluate(() => {
-        const links = [];
-        const records = document.querySelectorAll('[id^="entityRecordDiv"]');
-        records.forEach(rec => {
-          const link = rec.querySelector('a[href*="#/permit/"]');
-          if (link) {
-            // Extract permit ID from the record text
-            const text = rec.innerText;
-            const permitMatch = text.match(/Permit Number\s*([A-Z0-9-]+)/i);
-            const addressMatch = text.match(/Address\s*([^\n]+)/i);
-            links.push({
-              permit_id: permitMatch ? permitMatch[1].trim() : 'Unknown',
-              address: addressMatch ? addressMatch[1].trim() : '',
-              detail_link: link.getAttribute('href')
-            });
-          }
-        });
-        return links;
-      });
+      const permitLinks = await page.evaluate(readPermitLinks, RESULTS_SELECTOR);
 
       console.log(`Found ${permitLinks.length} permits on page ${pageNum}`);
 
-      // Get details for each permit
+      // Get details for each permit. Detail pages are batched into DeepSeek calls
+      // that run in the background while the browser loads the next page.
+      const extractions = [];
+      let batch = [];
+      const flushBatch = () => {
+        extractions.push(extractDetailBatch(batch));
+        batch = [];
+      };
       for (const permit of permitLinks) {
+        // Results can shift between page clicks; skip permits already fetched
+        if (permit.permit_id !== 'Unknown' && !isNewPermit(seen, permit)) {
+          console.log(`  Skipping ${permit.permit_id} (already collected)`);
+          continue;
+        }
         console.log(`  Getting details for ${permit.permit_id}...`);
 
+        // Detail links differ only in the URL hash, so without a reset the
+        // previous permit's view (and its contacts) would still be on the tab
+        // and pass the detail wait at once
         const detailUrl = `https://energov.cityofsouthlake.com/EnerGov_Prod/SelfService${permit.detail_link}`;
-        await page.goto(detailUrl, { waitUntil: 'networkidle2', timeout: 30000 });
-        await new Promise(r => setTimeout(r, 3000));
+        await detailPage.goto('about:blank');
+        await gotoWithRetry(detailPage, detailUrl, { waitUntil: 'domcontentloaded', timeout: 30000 });
+        await waitForPermitDetail(detailPage, permit.permit_id === 'Unknown' ? null : permit.permit_id, 15000);
 
-        const detailHtml = cleanHTML(await page.content());
+        const detailHtml = cleanHTML(await resultsHTML(detailPage, DETAIL_VIEW_SELECTOR))
+          .substring(0, MAX_DETAIL_HTML);
 
-        const detailPrompt = `Extract permit details from this HTML. Return JSON:
-{
-  "permit_id": "...",
-  "address": "...",
-  "type": "...",
-  "status": "...",
-  "applied_date": "...",
-  "issued_date": "...",
-  "finalized_date": "...",
-  "description": "...",
-  "valuation": "...",
-  "contractor": {
-    "company": "...",
-    "contact_name": "...",
-    "type": "Applicant/Contractor/etc"
-  }
-}
+        // Replies are matched back by permit number, so one we couldn't read goes alone
+        const solo = permit.permit_id === 'Unknown';
+        if (batch.length > 0 && (solo || !fitsBatch(batch, detailHtml))) flushBatch();
+        batch.push({ permit, html: detailHtml });
+        if (solo || batch.length === MAX_DETAILS_PER_BATCH) flushBatch();
 
-Look for Contacts table with aria-label attributes like "Company ...", "First Name ...", "Last Name ...".
-The contractor is usually Type="Applicant" or "Contractor".
-
-HTML (first 100000 chars):
-${detailHtml.substring(0, 100000)}`;
+        // Rate limit
+        await new Promise(r => setTimeout(r, 500));
+      }
 
-        const response = await callDeepSeek(detailPrompt, 2000);
-        const details = extractJSON(response);
+      if (batch.length > 0) flushBatch();
 
+      for (const { permit, details } of (await Promise.all(extractions)).flat()) {
         if (details) {
           allPermits.push(details);
           const contractor = details.contractor?.company || 'No contractor';
-          console.log(`    ✓ ${details.type} - ${contractor}`);
+          console.log(`  ✓ ${permit.permit_id}: ${details.type} - ${contractor}`);
         } else {
-          console.log(`    ✗ Failed to parse`);
+          console.log(`  ✗ ${permit.permit_id}: Failed to parse`);
           allPermits.push({ permit_id: permit.permit_id, error: 'Failed to parse' });
         }
-
-        // Rate limit
-        await new Promise(r => setTimeout(r, 500));
       }
 
-      // Navigate to next page if not last
+      // Navigate to next page if not last. The search tab is still on this
+      // page of the sorted results, so one click moves it forward.
       if (pageNum < 3) {
         console.log(`\nNavigating to page ${pageNum + 1}...`);
-        // Go back to search and navigate to next page
-        await page.goto('https://energov.cityofsouthlake.com/EnerGov_Prod/SelfService#/search?m=2&ps=10&pn=1&em=true',
-          { waitUntil: 'networkidle2', timeout: 60000 });
-        await new Promise(r => setTimeout(r, 3000));
-
-        // Click search
-        const searchBtn2 = await page.$('#button-Search');
-        if (searchBtn2) await searchBtn2.click();
-        await new Promise(r => setTimeout(r, 4000));
-
-        // Sort again
-        await page.select('#PermitCriteria_SortBy', 'string:FinalDate');
-        await new Promise(r => setTimeout(r, 1000));
-        await page.select('#SortAscending', 'boolean:false');
-        await new Promise(r => setTimeout(r, 3000));
-
-        // Click next page button
-        const nextBtn = await page.$('.pagination-next-page');
-        if (nextBtn) {
-          for (let i = 0; i < pageNum; i++) {
-            await nextBtn.click();
-            await new Promise(r => setTimeout(r, 2000));
-          }
+        const nextBtn = (await page.evaluateHandle(findEnerGovPageLink, pageNum + 1)).asElement();
+        if (!nextBtn) {
+          console.log('  No more pages');
+          break;
+        }
+        // If the results never change, reading on would just re-read this page
+        // and skip every record as already collected
+        const changed = await afterResultsChange(page, RESULTS_SELECTOR, () => nextBtn.click(), 4000);
+        if (!changed) {
+          console.log(`  Page ${pageNum + 1} did not load, stopping`);
+          break;
         }
       }
     }
@@ -215,7 +259,9 @@ ${detailHtml.substring(0, 100000)}`;
   } catch (error) {
     console.error('Error:', error.message);
   } finally {
-    await browser.close();
+    await detailPage.close();
+    await page.close();
+    await closeBrowser();
   }
 }
 
@@ -0,0 +1,165 @@
+/**
+ * Puppeteer page helpers shared by the scrapers.
+ */
+
+const puppeteer = require('puppeteer');
+const fs = require('fs');
+const { withRetry } = require('./retry');
+
+// Launch options shared by getBrowser() and browser_server.js. Set
+// BROWSER_PROFILE_DIR to keep Chromium's profile (HTTP cache, cookies) between
+// runs, so the portals' script bundles aren't downloaded again every time.
+// Set BROWSER_PROXY (e.g. http://127.0.0.1:8080) to send page traffic through
+// a local caching proxy during development re-runs.
+const LAUNCH_OPTIONS = {
+  headless: 'new',
+  args: [
+    '--no-sandbox',
+    '--disable-setuid-sandbox',
+    ...(process.env.BROWSER_PROXY ? [`--proxy-server=${process.env.BROWSER_PROXY}`] : [])
+  ],
+  userDataDir: process.env.BROWSER_PROFILE_DIR || undefined
+};
+
+// Set BROWSER_WS_ENDPOINT (printed by browser_server.js) to attach to an
+// already-running Chromium instead of paying its startup on every run
+const BROWSER_WS_ENDPOINT = process.env.BROWSER_WS_ENDPOINT;
+
+// One Chromium per process. Launching costs a second or two, so callers that
+// scrape several portals (or import the pull* functions) share this browser
+// and open their own pages on it. If Chromium crashes or is closed, the next
+// getBrowser() launches a fresh one instead of handing out a dead handle.
+let browserPromise = null;
+
+function getBrowser() {
+  if (!browserPromise) {
+    const launching = BROWSER_WS_ENDPOINT
+      ? puppeteer.connect({ browserWSEndpoint: BROWSER_WS_ENDPOINT })
+      : puppeteer.launch(LAUNCH_OPTIONS);
+    browserPromise = launching;
+    const forget = () => {
+      if (browserPromise === launching) browserPromise = null;
+    };
+    launching.then(browser => browser.once('disconnected', forget), forget);
+  }
+  return browserPromise;
+}
+
+// Close the browser we launched, or just detach from a shared one
+async function closeBrowser() {
+  if (!browserPromise) return;
+  const browser = await browserPromise.catch(() => null);
+  browserPromise = null;
+  if (!browser) return;
+  if (BROWSER_WS_ENDPOINT) {
+    await browser.disconnect();
+  } else {
+    await browser.close();
+  }
+}
+
+// Set DEBUG_DUMP=1 to save raw page HTML under debug_html/
+const DEBUG_DUMP = process.env.DEBUG_DUMP === '1';
+
+// Create the dump directory once, and only when dumps are on
+if (DEBUG_DUMP) fs.mkdirSync('debug_html', { recursive: true });
+
+// Write a debug HTML snapshot without blocking the browser loop
+function dumpDebugHTML(filename, html) {
+  if (!DEBUG_DUMP) return;
+  fs.promises.writeFile(`debug_html/${filename}`, html)
+    .catch(e => console.log(`  Debug dump failed: ${e.message}`));
+}
+
+// Resource types the scrapers never read; aborting them speeds up page loads
+const BLOCKED_RESOURCE_TYPES = new Set(['image', 'font', 'media', 'stylesheet']);
+
+// Third-party analytics/ad hosts whose beacons only slow page loads down
+const BLOCKED_HOSTS_RE = /(^|\.)(googletagmanager\.com|google-analytics\.com|doubleclick\.net|hotjar\.com|newrelic\.com|nr-data\.net)$/;
+
+function isBlockedHost(url) {
+  try {
+    return BLOCKED_HOSTS_RE.test(new URL(url).hostname);
+  } catch (e) {
+    return false;
+  }
+}
+
+async function blockHeavyResources(page) {
+  await page.setRequestInterception(true);
+  page.on('request', request => {
+    if (BLOCKED_RESOURCE_TYPES.has(request.resourceType()) || isBlockedHost(request.url())) {
+      request.abort();
+    } else {
+      request.continue();
+    }
+  });
+}
+
+// Wait for selector instead of sleeping a fixed time. Times out quietly
+// so a slow portal degrades the same way the old fixed sleeps did.
+async function waitForElement(page, selector, timeout = 30000) {
+  try {
+    await page.waitForSelector(selector, { timeout });
+    return true;
+  } catch (e) {
+    console.log(`  Timed out waiting for ${selector}`);
+    return false;
+  }
+}
+
+// Runs in the page: text of the first result, or null before any render
+function firstResultText(selector) {
+  return document.querySelector(selector)?.innerText ?? null;
+}
+
+// Runs in the page: whether the first result now differs from previous
+function firstResultChanged(selector, previous) {
+  const first = document.querySelector(selector);
+  return first !== null && first.innerText !== previous;
+}
+
+// Run action (a sort, a pager click) and wait for the first element matching
+// selector to change text, i.e. for the results to re-render. timeout is the
+// fixed sleep this replaces, so an unchanged first result costs no more.
+async function afterResultsChange(page, selector, action, timeout) {
+  const before = await page.evaluate(firstResultText, selector);
+  await action();
+  try {
+    await page.waitForFunction(firstResultChanged, { timeout }, selector, before);
+    return true;
+  } catch (e) {
+    return false;
+  }
+}
+
+// page.goto with one retry, for portal pages that occasionally time out or
+// drop the connection on first load
+function gotoWithRetry(page, url, options) {
+  return withRetry(() => page.goto(url, options), { attempts: 2, baseDelay: 2000, label: 'Page load' });
+}
+
+// Runs in the page: the matched elements' markup, one per line
+function joinOuterHTML(elements) {
+  return elements.map(el => el.outerHTML).join('\n');
+}
+
+// Return the outerHTML of the results elements matching selector,
+// falling back to the full page when the selector finds nothing
+async function resultsHTML(page, selector) {
+  const fragment = await page.$$eval(selector, joinOuterHTML);
+  return fragment || page.content();
+}
+
+module.exports = {
+  LAUNCH_OPTIONS,
+  getBrowser,
+  closeBrowser,
+  DEBUG_DUMP,
+  dumpDebugHTML,
+  blockHeavyResources,
+  waitForElement,
+  gotoWithRetry,
+  afterResultsChange,
+  resultsHTML
+};
@@ -0,0 +1,176 @@
+/**
+ * DeepSeek helpers shared by the scrapers: the streaming API call plus
+ * HTML cleanup before prompting and JSON recovery from the reply.
+ */
+
+const crypto = require('crypto');
+const fs = require('fs');
+const path = require('path');
+const { RETRYABLE_STATUS, parseRetryAfter, withRetry } = require('./retry');
+
+const DEEPSEEK_API_KEY = process.env.DEEPSEEK_API_KEY;
+
+// Replies are cached on disk by prompt hash so re-running over unchanged pages
+// costs nothing. Set DEEPSEEK_CACHE=0 to always call the API.
+const CACHE_ENABLED = process.env.DEEPSEEK_CACHE !== '0';
+const CACHE_DIR = path.join('.cache', 'deepseek');
+const CACHE_TTL_MS = 7 * 24 * 60 * 60 * 1000;
+
+// Patterns used by cleanHTML / extractJSON, compiled once at load.
+// NON_CONTENT_RE strips style/script/svg elements and comments in one pass.
+const NON_CONTENT_RE = /<(style|script|svg)[^>]*>[\s\S]*?<\/\1>|<!--[\s\S]*?-->/gi;
+const WHITESPACE_RE = /\s+/g;
+const JSON_FENCE_RE = /```(?:json)?\s*([\s\S]*?)```/;
+const JSON_OBJECT_RE = /\{[\s\S]*\}/;
+
+// Tracks brace depth across streamed text, ignoring braces inside JSON strings.
+// The returned function reports true once the first top-level object closes.
+function createJSONCloseDetector() {
+  let depth = 0;
+  let opened = false;
+  let inString = false;
+  let escaped = false;
+  return text => {
+    for (const ch of text) {
+      if (inString) {
+        if (escaped) escaped = false;
+        else if (ch === '\\') escaped = true;
+        else if (ch === '"') inString = false;
+      } else if (ch === '"' && opened) {
+        inString = true;
+      } else if (ch === '{') {
+        depth++;
+        opened = true;
+      } else if (ch === '}' && opened && --depth === 0) {
+        return true;
+      }
+    }
+    return false;
+  };
+}
+
+// Send the request, retrying network errors, 429s and 5xx. Only the request
+// is retried; once the stream starts, a failure is passed to the caller.
+function openDeepSeekStream(prompt, maxTokens) {
+  return withRetry(async () => {
+    const response = await fetch('https://api.deepseek.com/v1/chat/completions', {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        'Authorization': `Bearer ${DEEPSEEK_API_KEY}`
+      },
+      body: JSON.stringify({
+        model: 'deepseek-chat',
+        messages: [{ role: 'user', content: prompt }],
+        temperature: 0.1,
+        max_tokens: maxTokens,
+        stream: true
+      })
+    });
+    if (!response.ok) {
+      const error = new Error(`DeepSeek HTTP ${response.status}: ${(await response.text()).substring(0, 200)}`);
+      error.retryable = RETRYABLE_STATUS.has(response.status);
+      error.retryAfterMs = parseRetryAfter(response.headers.get('retry-after'));
+      throw error;
+    }
+    return response;
+  }, { label: 'DeepSeek call' });
+}
+
+async function streamDeepSeek(prompt, maxTokens) {
+  const response = await openDeepSeekStream(prompt, maxTokens);
+
+  // Read the server-sent events as they arrive and stop as soon as the
+  // reply's JSON object is complete, skipping any trailing tokens
+  const decoder = new TextDecoder();
+  const jsonClosed = createJSONCloseDetector();
+  let buffered = '';
+  let content = '';
+  for await (const chunk of response.body) {
+    buffered += decoder.decode(chunk, { stream: true });
+    const lines = buffered.split('\n');
+    buffered = lines.pop();
+    for (const line of lines) {
+      if (!line.startsWith('data:')) continue;
+      const payload = line.slice(5).trim();
+      if (payload === '[DONE]') return content;
+      const event = JSON.parse(payload);
+      // An error mid-stream arrives as an event with no choices
+      if (event.error) throw new Error(`DeepSeek stream error: ${event.error.message || JSON.stringify(event.error)}`);
+      const delta = event.choices?.[0]?.delta?.content || '';
+      content += delta;
+      if (jsonClosed(delta)) return content;
+    }
+  }
+  return content;
+}
+
+function cachePath(prompt, maxTokens) {
+  const key = crypto.createHash('sha256').update(`${maxTokens}\n${prompt}`).digest('hex').slice(0, 32);
+  return path.join(CACHE_DIR, `${key}.txt`);
+}
+
+// Cached reply for this prompt, or null if missing or older than CACHE_TTL_MS
+async function readCache(file) {
+  try {
+    const stat = await fs.promises.stat(file);
+    if (Date.now() - stat.mtimeMs > CACHE_TTL_MS) return null;
+    return await fs.promises.readFile(file, 'utf8');
+  } catch (e) {
+    return null;
+  }
+}
+
+// Write via a temp file and rename so a concurrent reader never sees a partial
+// reply. The temp name is unique per write, since two calls in this process
+// can cache the same prompt at once.
+async function writeCache(file, content) {
+  try {
+    await fs.promises.mkdir(CACHE_DIR, { recursive: true });
+    const tmp = `${file}.${process.pid}.${crypto.randomBytes(4).toString('hex')}.tmp`;
+    await fs.promises.writeFile(tmp, content);
+    await fs.promises.rename(tmp, file);
+  } catch (e) {
+    console.log(`  DeepSeek cache write failed: ${e.message}`);
+  }
+}
+
+async function callDeepSeek(prompt, maxTokens = 4000) {
+  if (!CACHE_ENABLED) return streamDeepSeek(prompt, maxTokens);
+
+  const file = cachePath(prompt, maxTokens);
+  const cached = await readCache(file);
+  if (cached !== null) return cached;
+
+  // Only cache replies that parse, so a truncated answer is retried next run
+  const content = await streamDeepSeek(prompt, maxTokens);
+  if (extractJSON(content)) await writeCache(file, content);
+  return content;
+}
+
+function cleanHTML(html) {
+  return html.replace(NON_CONTENT_RE, '').replace(WHITESPACE_RE, ' ');
+}
+
+function extractJSON(text) {
+  try {
+    return JSON.parse(text);
+  } catch (e) {
+    const jsonMatch = text.match(JSON_FENCE_RE);
+    if (jsonMatch) {
+      try { return JSON.parse(jsonMatch[1].trim()); } catch (e2) {}
+    }
+    const objMatch = text.match(JSON_OBJECT_RE);
+    if (objMatch) {
+      try { return JSON.parse(objMatch[0]); } catch (e3) {}
+    }
+    return null;
+  }
+}
+
+module.exports = {
+  DEEPSEEK_API_KEY,
+  callDeepSeek,
+  cleanHTML,
+  extractJSON
+};
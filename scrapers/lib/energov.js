@@ -0,0 +1,105 @@
+/**
+ * EnerGov (Southlake) search page helpers. The functions marked "runs in
+ * the page" are passed to page.evaluate and must not close over anything.
+ */
+
+// One div per permit on the EnerGov search results page
+const RESULTS_SELECTOR = '[id^="entityRecordDiv"]';
+
+// EnerGov sort controls for "Finalized Date, newest first"
+const FINAL_DATE_SORT = [
+  ['PermitCriteria_SortBy', 'string:FinalDate'],
+  ['SortAscending', 'boolean:false']
+];
+
+// Runs in the page: set every sort control in one round-trip, firing the
+// change events AngularJS listens for (what page.select does per control)
+function applySort(controls) {
+  for (const [id, value] of controls) {
+    const select = document.getElementById(id);
+    if (!select) throw new Error(`No element found for selector: #${id}`);
+    select.value = value;
+    select.dispatchEvent(new Event('input', { bubbles: true }));
+    select.dispatchEvent(new Event('change', { bubbles: true }));
+  }
+}
+
+// Runs in the page: find the EnerGov pager control for the given page number,
+// checking every known pager variant in a single DOM pass
+function findEnerGovPageLink(nextPage) {
+  return document.querySelector('a[ng-click*="nextPage"]') ||
+    document.querySelector(`a[ng-click*="goToPage(${nextPage})"]`) ||
+    document.querySelector('.pagination-next-page');
+}
+
+// Runs in the page: permit number, address and detail link for each result
+// record that links to a permit detail page
+function readPermitLinks(selector) {
+  const links = [];
+  const records = document.querySelectorAll(selector);
+  records.forEach(rec => {
+    const link = rec.querySelector('a[href*="#/permit/"]');
+    if (link) {
+      // Extract permit ID from the record text
+      const text = rec.innerText;
+      const permitMatch = text.match(/Permit Number\s*([A-Z0-9-]+)/i);
+      const addressMatch = text.match(/Address\s*([^\n]+)/i);
+      links.push({
+        permit_id: permitMatch ? permitMatch[1].trim() : 'Unknown',
+        address: addressMatch ? addressMatch[1].trim() : '',
+        detail_link: link.getAttribute('href')
+      });
+    }
+  });
+  return links;
+}
+
+// AngularJS view container holding the permit detail page, without the
+// portal's header, menus and footer
+const DETAIL_VIEW_SELECTOR = '[ng-view], [ui-view]';
+
+// Company cells of the detail page's Contacts table (aria-label="Company ...")
+const CONTACTS_SELECTOR = '[aria-label^="Company "]';
+
+// Contacts load after the rest of the view, and some permits have none, so
+// they get a short ceiling of their own (the old fixed settle sleep)
+const CONTACTS_TIMEOUT = 4000;
+
+// Runs in the page: whether the search results have been replaced by a view
+// showing permitId. The search list shows the same number, so the results
+// must be gone first. With permitId null, any view with a "Permit Number"
+// label counts, which only identifies the permit on a freshly reset tab.
+function detailViewShown(resultsSelector, permitId) {
+  if (document.querySelector(resultsSelector)) return false;
+  const text = document.body?.innerText ?? '';
+  return permitId ? text.includes(permitId) : /Permit Number/i.test(text);
+}
+
+// Wait for a permit detail page to show permitId, then for its Contacts rows.
+// Detail links only change the URL hash and pages load only to
+// domcontentloaded, so this is what waits for the AngularJS detail view and
+// its data. Pass null for permitId when the number couldn't be read, and only
+// on a tab that doesn't still hold an earlier permit's view.
+async function waitForPermitDetail(page, permitId, timeout) {
+  try {
+    await page.waitForFunction(detailViewShown, { timeout }, RESULTS_SELECTOR, permitId);
+  } catch (e) {
+    return false;
+  }
+  try {
+    await page.waitForSelector(CONTACTS_SELECTOR, { timeout: CONTACTS_TIMEOUT });
+  } catch (e) {
+    console.log('    No contacts rendered on detail page');
+  }
+  return true;
+}
+
+module.exports = {
+  RESULTS_SELECTOR,
+  DETAIL_VIEW_SELECTOR,
+  FINAL_DATE_SORT,
+  applySort,
+  findEnerGovPageLink,
+  readPermitLinks,
+  waitForPermitDetail
+};
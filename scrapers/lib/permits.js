@@ -0,0 +1,14 @@
+/**
+ * Helpers for permit records once they've been pulled from a portal.
+ */
+
+// Pages can overlap when results shift between clicks. Returns true the first
+// time a permit_id is seen; permits without an id can't be compared and are kept.
+function isNewPermit(seen, permit) {
+  if (!permit.permit_id) return true;
+  if (seen.has(permit.permit_id)) return false;
+  seen.add(permit.permit_id);
+  return true;
+}
+
+module.exports = { isNewPermit };
@@ -0,0 +1,36 @@
+/**
+ * Retry with exponential backoff and jitter for DeepSeek calls and page loads.
+ */
+
+// HTTP statuses worth retrying: rate limiting and transient server errors
+const RETRYABLE_STATUS = new Set([429, 500, 502, 503, 504]);
+
+// Retry-After is either delay-seconds or an HTTP date; returns ms or undefined
+function parseRetryAfter(header) {
+  if (!header) return undefined;
+  const seconds = Number(header);
+  if (Number.isFinite(seconds)) return Math.max(0, seconds * 1000);
+  const date = Date.parse(header);
+  return Number.isNaN(date) ? undefined : Math.max(0, date - Date.now());
+}
+
+// Run fn until it succeeds or attempts run out. Errors with retryable === false
+// are rethrown at once; an error's retryAfterMs overrides the backoff delay.
+async function withRetry(fn, { attempts = 4, baseDelay = 500, label = 'Request' } = {}) {
+  for (let attempt = 1; ; attempt++) {
+    try {
+      return await fn();
+    } catch (e) {
+      if (attempt >= attempts || e.retryable === false) throw e;
+      const delay = e.retryAfterMs ?? baseDelay * 2 ** (attempt - 1) + Math.random() * 300;
+      console.log(`  ${label} failed (${e.message}), retrying in ${Math.round(delay)}ms...`);
+      await new Promise(r => setTimeout(r, delay));
+    }
+  }
+}
+
+module.exports = {
+  RETRYABLE_STATUS,
+  parseRetryAfter,
+  withRetry
+};
@@ -2,229 +2,330 @@
 /**
  * Pull 50 raw permits each from Southlake and Fort Worth
  * No filtering - just grab recent permits with whatever data is available
+ * Output: raw_permits_50.ndjson (one permit per line) + raw_permits_50.meta.json
+ *
+ * Usage: node pull_50_permits.js [city[:count] ...]
+ *   e.g. node pull_50_permits.js southlake:20 fort_worth
  */
 
-const puppeteer = require('puppeteer');
 const fs = require('fs');
+const { once } = require('events');
+
+const { callDeepSeek, cleanHTML, extractJSON, DEEPSEEK_API_KEY } = require('./lib/deepseek');
+const {
+  getBrowser,
+  closeBrowser,
+  DEBUG_DUMP,
+  dumpDebugHTML,
+  blockHeavyResources,
+  waitForElement,
+  gotoWithRetry,
+  afterResultsChange,
+  resultsHTML
+} = require('./lib/browser');
+const { RESULTS_SELECTOR: SOUTHLAKE_RESULTS_SELECTOR, FINAL_DATE_SORT, applySort, findEnerGovPageLink } = require('./lib/energov');
+const { isNewPermit } = require('./lib/permits');
+
+// Accela results grid sent to DeepSeek instead of the whole page
+const FORT_WORTH_RESULTS_SELECTOR = 'table[id*="gdvPermitList"]';
+
+// Results per EnerGov search page (ps=10 in the search URL)
+const SOUTHLAKE_PAGE_SIZE = 10;
+
+// Most result pages read per run, leaving headroom past the target for
+// duplicates and failed extractions
+const SOUTHLAKE_MAX_PAGES = 6;
+
+// Character budget for the HTML portion of a single extraction prompt
+const MAX_PROMPT_HTML = 150000;
+
+// Upper bound on pages per call so the output stays within max_tokens
+const MAX_PAGES_PER_BATCH = 3;
+
+// Whether html can join batch without exceeding the prompt budget
+function fitsBatch(batch, html) {
+  const size = batch.reduce((total, h) => total + h.length, 0);
+  return size + html.length <= MAX_PROMPT_HTML;
+}
 
-const DEEPSEEK_API_KEY = process.env.DEEPSEEK_API_KEY;
+// Fixed prompt prefix; the page HTML is appended per call so the prefix stays byte-identical
+const SOUTHLAKE_EXTRACT_PROMPT = `Extract ALL permit records from these Southlake EnerGov search results pages.
 
-async function callDeepSeek(prompt, maxTokens = 8000) {
-  const response = await fetch('https://api.deepseek.com/v1/chat/completions', {
-    method: 'POST',
-    headers: {
-      'Content-Type': 'application/json',
-      'Authorization': `Bearer ${DEEPSEEK_API_KEY}`
-    },
-    body: JSON.stringify({
-      model: 'deepseek-chat',
-      messages: [{ role: 'user', content: prompt }],
-      temperature: 0.1,
-      max_tokens: maxTokens
-    })
-  });
-  const data = await response.json();
-  return data.choices[0].message.content;
-}
+The pages follow, each wrapped in <PAGE n>...</PAGE n> tags. Extract all permits from all of them.
+
+For EACH permit record visible, extract:
+- permit_id: Permit number
+- address: Full address
+- type: Permit type
+- applied_date: Application date
+- issued_date: Issue date
+- finalized_date: Finalized date
+- status: Current status
+- description: Project description
+- contractor: Any contractor/applicant name visible
+- detail_link: Link to detail page (href with GUID)
 
-function cleanHTML(html) {
-  let cleaned = html.replace(/<style[^>]*>[\s\S]*?<\/style>/gi, '');
-  cleaned = cleaned.replace(/<script[^>]*>[\s\S]*?<\/script>/gi, '');
-  cleaned = cleaned.replace(/<!--[\s\S]*?-->/g, '');
-  cleaned = cleaned.replace(/<svg[^>]*>[\s\S]*?<\/svg>/gi, '');
-  cleaned = cleaned.replace(/\s+/g, ' ');
-  return cleaned;
+Return JSON with one flat array of permits across all pages:
+{
+  "permits": [
+    {
+      "permit_id": "...",
+      "address": "...",
+      "type": "...",
+      "applied_date": "...",
+      "issued_date": "...",
+      "finalized_date": "...",
+      "status": "...",
+      "description": "...",
+      "contractor": "...",
+      "detail_link": "..."
+    }
+  ]
 }
 
-function extractJSON(text) {
+HTML:
+`;
+
+// Extract permits from several Southlake result pages with one DeepSeek call.
+// If the call fails (context exceeded, unparseable reply) the batch is halved and retried.
+async function extractSouthlakeBatch(pageHtmls) {
+  const pagesText = pageHtmls
+    .map((html, i) => `<PAGE ${i + 1}>\n${html}\n</PAGE ${i + 1}>`)
+    .join('\n\n');
+
+  const extractPrompt = SOUTHLAKE_EXTRACT_PROMPT + pagesText;
+
+  let data = null;
   try {
-    return JSON.parse(text);
+    data = extractJSON(await callDeepSeek(extractPrompt, 8000));
   } catch (e) {
-    const jsonMatch = text.match(/```(?:json)?\s*([\s\S]*?)```/);
-    if (jsonMatch) {
-      try { return JSON.parse(jsonMatch[1].trim()); } catch (e2) {}
-    }
-    const objMatch = text.match(/\{[\s\S]*\}/);
-    if (objMatch) {
-      try { return JSON.parse(objMatch[0]); } catch (e3) {}
-    }
-    return null;
+    console.log(`  DeepSeek call failed: ${e.message}`);
   }
+
+  if (data && data.permits) return data.permits;
+  if (pageHtmls.length === 1) return [];
+
+  console.log(`  Batch of ${pageHtmls.length} failed, splitting...`);
+  const mid = Math.ceil(pageHtmls.length / 2);
+  return [
+    ...await extractSouthlakeBatch(pageHtmls.slice(0, mid)),
+    ...await extractSouthlakeBatch(pageHtmls.slice(mid))
+  ];
 }
 
-async function pullSouthlake(browser, targetCount = 50) {
+// Yields Southlake permits as their extraction batches come back
+async function* pullSouthlake(browser, targetCount = 50, scrapedAt = new Date().toISOString()) {
   console.log('\n========================================');
   console.log('SOUTHLAKE - Pulling permits');
   console.log('========================================\n');
 
   const page = await browser.newPage();
+  await blockHeavyResources(page);
   await page.setViewport({ width: 1280, height: 900 });
   await page.setUserAgent('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36');
 
-  const allPermits = [];
+  const seen = new Set();
+  let count = 0;
 
   try {
     // Go to search page
     console.log('Loading Southlake EnerGov portal...');
     const searchUrl = 'https://energov.cityofsouthlake.com/EnerGov_Prod/SelfService#/search?m=2&ps=10&pn=1&em=true';
-    await page.goto(searchUrl, { waitUntil: 'networkidle2', timeout: 60000 });
-    await new Promise(r => setTimeout(r, 5000));
+    await gotoWithRetry(page, searchUrl, { waitUntil: 'domcontentloaded', timeout: 30000 });
+    await waitForElement(page, '#button-Search');
 
     // Click search to get all permits
     console.log('Clicking search button...');
     const searchBtn = await page.$('#button-Search');
     if (searchBtn) {
       await searchBtn.click();
-      await new Promise(r => setTimeout(r, 5000));
+      await waitForElement(page, SOUTHLAKE_RESULTS_SELECTOR);
     }
 
     // Sort by most recent
     console.log('Sorting by Finalized Date (newest first)...');
     try {
-      await page.select('#PermitCriteria_SortBy', 'string:FinalDate');
-      await new Promise(r => setTimeout(r, 1000));
-      await page.select('#SortAscending', 'boolean:false');
-      await new Promise(r => setTimeout(r, 4000));
+      await afterResultsChange(page, SOUTHLAKE_RESULTS_SELECTOR,
+        () => page.evaluate(applySort, FINAL_DATE_SORT), 4000);
     } catch (e) {
       console.log('  Sort failed, continuing with default order');
     }
 
-    // Pull multiple pages
-    let pageNum = 1;
-    while (allPermits.length < targetCount && pageNum <= 6) {
-      console.log(`\nExtracting page ${pageNum}...`);
-
-      const html = await page.content();
-      const cleanedHtml = cleanHTML(html);
-
-      const extractPrompt = `Extract ALL permit records from this Southlake EnerGov search results page.
-
-For EACH permit record visible, extract:
-- permit_id: Permit number
-- address: Full address
-- type: Permit type
-- applied_date: Application date
-- issued_date: Issue date
-- finalized_date: Finalized date
-- status: Current status
-- description: Project description
-- contractor: Any contractor/applicant name visible
-- detail_link: Link to detail page (href with GUID)
-
-Return JSON array of permits:
-{
-  "permits": [
-    {
-      "permit_id": "...",
-      "address": "...",
-      "type": "...",
-      "applied_date": "...",
-      "issued_date": "...",
-      "finalized_date": "...",
-      "status": "...",
-      "description": "...",
-      "contractor": "...",
-      "detail_link": "..."
-    }
-  ],
-  "has_next_page": true/false,
-  "total_shown": <number of permits on this page>
-}
-
-HTML:
-${cleanedHtml.substring(0, 150000)}`;
-
-      const response = await callDeepSeek(extractPrompt);
-      const data = extractJSON(response);
+    // Capture result pages in rounds, each sized to the permits still missing,
+    // up to SOUTHLAKE_MAX_PAGES in all. Within a round each full batch goes to
+    // DeepSeek in the background while the browser moves on to the next page;
+    // duplicates or failed batches leave the count short and start another round.
+    let pageNum = 0;
+    let morePages = true;
+    while (count < targetCount && morePages && pageNum < SOUTHLAKE_MAX_PAGES) {
+      const roundEnd = Math.min(SOUTHLAKE_MAX_PAGES,
+        pageNum + Math.ceil((targetCount - count) / SOUTHLAKE_PAGE_SIZE));
+      const extractions = [];
+      let batch = [];
+      const flushBatch = () => {
+        console.log(`  Extracting ${batch.length} page(s) in the background...`);
+        extractions.push(extractSouthlakeBatch(batch));
+        batch = [];
+      };
+
+      // A paging failure (e.g. a crashed tab) stops capture but keeps the pages
+      // already captured and the extractions already running
+      try {
+        while (pageNum < roundEnd) {
+          // Try to go to next page
+          if (pageNum > 0) {
+            let nextLink;
+            try {
+              nextLink = (await page.evaluateHandle(findEnerGovPageLink, pageNum + 1)).asElement();
+            } catch (e) {
+              nextLink = null;
+            }
+            if (!nextLink) {
+              console.log('  No more pages');
+              morePages = false;
+              break;
+            }
+            // An unchanged page would only be extracted again and dropped as duplicates
+            if (!await afterResultsChange(page, SOUTHLAKE_RESULTS_SELECTOR, () => nextLink.click(), 4000)) {
+              console.log(`  Page ${pageNum + 1} did not load, stopping`);
+              morePages = false;
+              break;
+            }
+          }
 
-      if (data && data.permits) {
-        for (const p of data.permits) {
-          p.source = 'southlake';
-          p.scraped_at = new Date().toISOString();
-          allPermits.push(p);
+          pageNum++;
+          console.log(`\nCapturing page ${pageNum}...`);
+          const html = cleanHTML(await resultsHTML(page, SOUTHLAKE_RESULTS_SELECTOR)).substring(0, MAX_PROMPT_HTML);
+          if (batch.length > 0 && !fitsBatch(batch, html)) flushBatch();
+          batch.push(html);
+          if (batch.length === MAX_PAGES_PER_BATCH) flushBatch();
         }
-        console.log(`  Got ${data.permits.length} permits (total: ${allPermits.length})`);
+      } catch (e) {
+        console.error(`  Page capture failed: ${e.message}`);
+        morePages = false;
       }
 
-      // Try to go to next page
-      if (allPermits.length < targetCount) {
-        try {
-          const nextBtn = await page.$('a[ng-click*="nextPage"]');
-          if (nextBtn) {
-            await nextBtn.click();
-            await new Promise(r => setTimeout(r, 4000));
-            pageNum++;
-          } else {
-            // Try clicking page number
-            const pageLink = await page.$(`a[ng-click*="goToPage(${pageNum + 1})"]`);
-            if (pageLink) {
-              await pageLink.click();
-              await new Promise(r => setTimeout(r, 4000));
-              pageNum++;
-            } else {
-              break;
-            }
-          }
-        } catch (e) {
-          console.log('  No more pages');
-          break;
+      if (batch.length > 0) flushBatch();
+
+      console.log(`\nWaiting on ${extractions.length} extraction call(s)...`);
+      for (const extraction of extractions) {
+        const permits = await extraction;
+        for (const p of permits) {
+          if (count >= targetCount) break;
+          if (!isNewPermit(seen, p)) continue;
+          p.source = 'southlake';
+          p.scraped_at = scrapedAt;
+          count++;
+          yield p;
         }
+        console.log(`  Got ${permits.length} permits (total: ${count})`);
       }
     }
 
-    console.log(`\nSouthlake complete: ${allPermits.length} permits`);
+    console.log(`\nSouthlake complete: ${count} permits`);
 
   } catch (error) {
     console.error('Southlake error:', error.message);
   } finally {
-    await page.close();
+    await page.close().catch(() => {});
   }
-
-  return allPermits.slice(0, targetCount);
 }
 
-async function pullFortWorth(browser, targetCount = 50) {
-  console.log('\n========================================');
-  console.log('FORT WORTH - Pulling permits');
-  console.log('========================================\n');
+// Accela grid header text -> permit field. First match wins per column.
+const FORT_WORTH_COLUMNS = [
+  [/record number|permit number/i, 'permit_id'],
+  [/record type|permit type/i, 'type'],
+  [/address/i, 'address'],
+  [/status/i, 'status'],
+  [/date/i, 'date'],
+  [/contractor|licensed professional/i, 'contractor'],
+  [/description|project name/i, 'description']
+];
+
+// Runs in the page: dump the Accela grid headers, row cells and pager state
+function readAccelaGrid(selector) {
+  const table = document.querySelector(selector);
+  if (!table) return null;
+  const headerRow = table.querySelector('tr.ACA_TabRow_Header');
+  return {
+    headers: headerRow ? Array.from(headerRow.cells, c => c.innerText.trim()) : [],
+    rows: Array.from(table.querySelectorAll('tr.ACA_TabRow_Odd, tr.ACA_TabRow_Even'),
+      r => Array.from(r.cells, c => c.innerText.trim())),
+    hasNext: Array.from(table.querySelectorAll('a')).some(a => a.textContent.includes('Next'))
+  };
+}
 
-  const page = await browser.newPage();
-  await page.setViewport({ width: 1280, height: 900 });
-  await page.setUserAgent('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36');
+// Runs in the page: find the Accela pager link for the given page number
+function findAccelaPageLink(nextPage) {
+  for (const link of document.querySelectorAll('a[href*="javascript:"][class*="aca"]')) {
+    const text = link.textContent;
+    if (text.includes('>') || text.includes('Next') || text.trim() === String(nextPage)) return link;
+  }
+  for (const link of document.querySelectorAll('a')) {
+    if (link.textContent?.trim() === String(nextPage)) return link;
+  }
+  return null;
+}
 
-  const allPermits = [];
+// Runs in the page: replay the pager link's __doPostBack as a fetch carrying
+// the form's __VIEWSTATE/__EVENTVALIDATION, then swap the returned grid and
+// hidden fields into the live document. Skips the full page load and render;
+// returns false so the caller can fall back to clicking.
+async function postBackAccelaPage(selector, link) {
+  const match = /__doPostBack\('([^']*)','([^']*)'\)/.exec(link.getAttribute('href') || '');
+  const form = document.getElementById('aspnetForm') || document.forms[0];
+  const current = document.querySelector(selector);
+  if (!match || !form || !current) return false;
+
+  const fields = new FormData(form);
+  fields.set('__EVENTTARGET', match[1]);
+  fields.set('__EVENTARGUMENT', match[2]);
+  const response = await fetch(form.action, {
+    method: 'POST',
+    body: new URLSearchParams(fields),
+    credentials: 'same-origin'
+  });
+  if (!response.ok) return false;
 
-  try {
-    // Go to Fort Worth Accela portal
-    console.log('Loading Fort Worth Accela portal...');
-    const url = 'https://aca-prod.accela.com/CFW/Cap/CapHome.aspx?module=Development&TabName=Development';
-    await page.goto(url, { waitUntil: 'networkidle2', timeout: 60000 });
-    await new Promise(r => setTimeout(r, 3000));
+  const doc = new DOMParser().parseFromString(await response.text(), 'text/html');
+  const grid = doc.querySelector(selector);
+  if (!grid) return false;
 
-    // Click search button to get results
-    console.log('Submitting search...');
-    try {
-      const searchBtn = await page.$('#ctl00_PlaceHolderMain_btnNewSearch');
-      if (searchBtn) {
-        await searchBtn.click();
-        await new Promise(r => setTimeout(r, 8000));
-      }
-    } catch (e) {
-      console.log('  Search button click failed:', e.message);
-    }
+  current.replaceWith(document.importNode(grid, true));
+  for (const input of doc.querySelectorAll('input[type="hidden"][name]')) {
+    const live = form.querySelector(`input[name="${CSS.escape(input.name)}"]`);
+    if (live) live.value = input.value;
+  }
+  return true;
+}
 
-    // Pull multiple pages
-    let pageNum = 1;
-    while (allPermits.length < targetCount && pageNum <= 6) {
-      console.log(`\nExtracting page ${pageNum}...`);
+// Map grid rows to permits by header text. Returns null when the layout
+// isn't recognised so the caller can fall back to DeepSeek.
+function parseAccelaGrid(grid) {
+  if (!grid || grid.rows.length === 0) return null;
 
-      const html = await page.content();
-      const cleanedHtml = cleanHTML(html);
+  const columns = grid.headers.map(header => {
+    const match = FORT_WORTH_COLUMNS.find(([pattern]) => pattern.test(header));
+    return match ? match[1] : null;
+  });
+  if (!columns.includes('permit_id')) return null;
+
+  const permits = [];
+  for (const cells of grid.rows) {
+    if (cells.length !== columns.length) continue;
+    const permit = {};
+    columns.forEach((field, i) => {
+      if (field && cells[i] && !permit[field]) permit[field] = cells[i];
+    });
+    if (permit.permit_id) permits.push(permit);
+  }
+  if (permits.length === 0) return null;
 
-      // Save debug
-      fs.writeFileSync(`debug_html/fortworth_page${pageNum}.html`, html);
+  return { permits, has_next_page: grid.hasNext, total_shown: permits.length };
+}
 
-      const extractPrompt = `Extract ALL permit records from this Fort Worth Accela search results page.
+// Fixed prompt prefix; the grid HTML is appended per call
+const FORT_WORTH_EXTRACT_PROMPT = `Extract ALL permit records from this Fort Worth Accela search results page.
 
 Look for a results table with permit data. For EACH permit row, extract:
 - permit_id: Permit/Record number (e.g., "PM25-10408", "PE25-14386")
@@ -253,51 +354,95 @@ Return JSON:
 }
 
 HTML:
-${cleanedHtml.substring(0, 150000)}`;
+`;
+
+async function extractFortWorthWithDeepSeek(cleanedHtml) {
+  const extractPrompt = FORT_WORTH_EXTRACT_PROMPT + cleanedHtml.substring(0, MAX_PROMPT_HTML);
+
+  const response = await callDeepSeek(extractPrompt, 8000);
+  return extractJSON(response);
+}
+
+// Yields Fort Worth permits page by page
+async function* pullFortWorth(browser, targetCount = 50, scrapedAt = new Date().toISOString()) {
+  console.log('\n========================================');
+  console.log('FORT WORTH - Pulling permits');
+  console.log('========================================\n');
+
+  const page = await browser.newPage();
+  await blockHeavyResources(page);
+  await page.setViewport({ width: 1280, height: 900 });
+  await page.setUserAgent('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36');
 
-      const response = await callDeepSeek(extractPrompt);
-      const data = extractJSON(response);
+  const seen = new Set();
+  let count = 0;
+
+  try {
+    // Go to Fort Worth Accela portal
+    console.log('Loading Fort Worth Accela portal...');
+    const url = 'https://aca-prod.accela.com/CFW/Cap/CapHome.aspx?module=Development&TabName=Development';
+    await gotoWithRetry(page, url, { waitUntil: 'domcontentloaded', timeout: 30000 });
+    await waitForElement(page, '#ctl00_PlaceHolderMain_btnNewSearch');
+
+    // Click search button to get results
+    console.log('Submitting search...');
+    try {
+      const searchBtn = await page.$('#ctl00_PlaceHolderMain_btnNewSearch');
+      if (searchBtn) {
+        await searchBtn.click();
+        await waitForElement(page, FORT_WORTH_RESULTS_SELECTOR);
+      }
+    } catch (e) {
+      console.log('  Search button click failed:', e.message);
+    }
+
+    // Pull multiple pages
+    let pageNum = 1;
+    while (count < targetCount && pageNum <= 6) {
+      console.log(`\nExtracting page ${pageNum}...`);
+
+      if (DEBUG_DUMP) dumpDebugHTML(`fortworth_page${pageNum}.html`, await page.content());
+
+      // Read the grid directly; only fall back to DeepSeek if the layout is unexpected
+      let data = parseAccelaGrid(await page.evaluate(readAccelaGrid, FORT_WORTH_RESULTS_SELECTOR));
+      if (data) {
+        console.log('  Parsed results grid directly');
+      } else {
+        console.log('  Grid not recognised, extracting with DeepSeek...');
+        data = await extractFortWorthWithDeepSeek(
+          cleanHTML(await resultsHTML(page, FORT_WORTH_RESULTS_SELECTOR)));
+      }
 
       if (data && data.permits) {
         for (const p of data.permits) {
+          if (count >= targetCount) break;
+          if (!isNewPermit(seen, p)) continue;
           p.source = 'fort_worth';
-          p.scraped_at = new Date().toISOString();
-          allPermits.push(p);
+          p.scraped_at = scrapedAt;
+          count++;
+          yield p;
         }
-        console.log(`  Got ${data.permits.length} permits (total: ${allPermits.length})`);
+        console.log(`  Got ${data.permits.length} permits (total: ${count})`);
       }
 
       // Try to go to next page
-      if (allPermits.length < targetCount && data?.has_next_page) {
+      if (count < targetCount && data?.has_next_page) {
         try {
-          // Accela pagination - look for next page link
-          const nextLinks = await page.$$('a[href*="javascript:"][class*="aca"]');
-          let clicked = false;
-
-          for (const link of nextLinks) {
-            const text = await page.evaluate(el => el.textContent, link);
-            if (text.includes('>') || text.includes('Next') || text.trim() === String(pageNum + 1)) {
-              await link.click();
-              await new Promise(r => setTimeout(r, 5000));
-              clicked = true;
-              pageNum++;
-              break;
-            }
-          }
-
-          if (!clicked) {
-            // Try direct page number click
-            const pageLinks = await page.$$('a');
-            for (const link of pageLinks) {
-              const text = await page.evaluate(el => el.textContent?.trim(), link);
-              if (text === String(pageNum + 1)) {
-                await link.click();
-                await new Promise(r => setTimeout(r, 5000));
-                pageNum++;
-                break;
-              }
-            }
+          // Accela pagination - locate the next page link in a single round-trip
+          const nextLink = (await page.evaluateHandle(findAccelaPageLink, pageNum + 1)).asElement();
+          if (!nextLink) break;
+
+          const posted = await page.evaluate(postBackAccelaPage, FORT_WORTH_RESULTS_SELECTOR, nextLink)
+            .catch(e => {
+              console.log(`  Direct postback failed: ${e.message}`);
+              return false;
+            });
+          if (!posted && !await afterResultsChange(page, `${FORT_WORTH_RESULTS_SELECTOR} tr.ACA_TabRow_Odd`,
+            () => nextLink.click(), 5000)) {
+            console.log(`  Page ${pageNum + 1} did not load, stopping`);
+            break;
           }
+          pageNum++;
         } catch (e) {
           console.log('  Pagination failed:', e.message);
           break;
@@ -307,20 +452,72 @@ ${cleanedHtml.substring(0, 150000)}`;
       }
     }
 
-    console.log(`\nFort Worth complete: ${allPermits.length} permits`);
+    console.log(`\nFort Worth complete: ${count} permits`);
 
   } catch (error) {
     console.error('Fort Worth error:', error.message);
   } finally {
-    await page.close();
+    await page.close().catch(() => {});
+  }
+}
+
+// One permit per line, written as each page is extracted so a crash keeps partial results
+const OUTPUT_FILE = 'raw_permits_50.ndjson';
+const META_FILE = 'raw_permits_50.meta.json';
+
+// Write each permit a puller yields to the NDJSON output as it arrives,
+// keeping only a count and a few samples for the summary. Waits for the
+// stream to drain whenever its buffer fills.
+async function writePermits(output, permits) {
+  const written = { count: 0, samples: [] };
+  for await (const permit of permits) {
+    if (!output.write(JSON.stringify(permit) + '\n')) await once(output, 'drain');
+    written.count++;
+    if (written.samples.length < 3) written.samples.push(permit);
   }
+  return written;
+}
 
-  return allPermits.slice(0, targetCount);
+// Cities this script can pull, keyed by the name used on the command line
+const CITIES = {
+  southlake: { label: 'Southlake', pull: pullSouthlake },
+  fort_worth: { label: 'Fort Worth', pull: pullFortWorth }
+};
+const DEFAULT_COUNT = 50;
+
+// Parse "city[:count]" arguments, e.g. "southlake:20 fort_worth". With no
+// arguments every city is pulled at DEFAULT_COUNT. Each city may appear once.
+function parseCityArgs(args) {
+  const specs = args.length > 0 ? args : Object.keys(CITIES);
+  const named = new Set();
+  return specs.map(spec => {
+    const [name, countText, ...rest] = spec.split(':');
+    if (!CITIES[name]) {
+      throw new Error(`Unknown city "${name}" (expected one of: ${Object.keys(CITIES).join(', ')})`);
+    }
+    if (named.has(name)) throw new Error(`City "${name}" given more than once`);
+    named.add(name);
+    if (rest.length > 0 || (countText !== undefined && !/^\d+$/.test(countText))) {
+      throw new Error(`Invalid count in "${spec}"`);
+    }
+    const count = countText === undefined ? DEFAULT_COUNT : Number(countText);
+    if (count < 1) throw new Error(`Invalid count in "${spec}"`);
+    return { name, count };
+  });
 }
 
 async function main() {
+  let targets;
+  try {
+    targets = parseCityArgs(process.argv.slice(2));
+  } catch (e) {
+    console.error(`ERROR: ${e.message}`);
+    console.error('Usage: node pull_50_permits.js [city[:count] ...]');
+    process.exit(1);
+  }
+
   console.log('==============================================');
-  console.log('Permit Puller - 50 each from Southlake & Fort Worth');
+  console.log(`Permit Puller - ${targets.map(t => `${t.count} from ${CITIES[t.name].label}`).join(', ')}`);
   console.log('==============================================');
   console.log(`Started: ${new Date().toISOString()}\n`);
 
@@ -329,59 +526,49 @@ async function main() {
     process.exit(1);
   }
 
-  // Ensure debug dir exists
-  if (!fs.existsSync('debug_html')) {
-    fs.mkdirSync('debug_html');
-  }
-
-  const browser = await puppeteer.launch({
-    headless: 'new',
-    args: ['--no-sandbox', '--disable-setuid-sandbox']
-  });
+  const pulledAt = new Date().toISOString();
+  const output = fs.createWriteStream(OUTPUT_FILE);
 
   try {
-    // Pull from both cities
-    const southlakePermits = await pullSouthlake(browser, 50);
-    const fortWorthPermits = await pullFortWorth(browser, 50);
-
-    // Combine results
-    const results = {
-      pulled_at: new Date().toISOString(),
-      southlake: {
-        count: southlakePermits.length,
-        permits: southlakePermits
-      },
-      fort_worth: {
-        count: fortWorthPermits.length,
-        permits: fortWorthPermits
-      },
-      total: southlakePermits.length + fortWorthPermits.length
-    };
-
-    // Save results
-    fs.writeFileSync('raw_permits_50.json', JSON.stringify(results, null, 2));
+    const browser = await getBrowser();
+
+    // Pull every city at once, each in its own tab of the shared browser,
+    // streaming permits to the NDJSON output as any city yields them
+    const written = await Promise.all(targets.map(({ name, count }) =>
+      writePermits(output, CITIES[name].pull(browser, count, pulledAt))));
+
+    // Run summary sidecar
+    const results = { pulled_at: pulledAt, output: OUTPUT_FILE };
+    targets.forEach(({ name }, i) => {
+      results[name] = { count: written[i].count };
+    });
+    results.total = written.reduce((total, w) => total + w.count, 0);
+    fs.writeFileSync(META_FILE, JSON.stringify(results, null, 2));
     console.log('\n==============================================');
     console.log('COMPLETE');
     console.log('==============================================');
-    console.log(`Southlake: ${southlakePermits.length} permits`);
-    console.log(`Fort Worth: ${fortWorthPermits.length} permits`);
+    targets.forEach(({ name }, i) => {
+      console.log(`${CITIES[name].label}: ${written[i].count} permits`);
+    });
     console.log(`Total: ${results.total} permits`);
-    console.log(`\nSaved to: raw_permits_50.json`);
+    console.log(`\nSaved to: ${OUTPUT_FILE} (summary in ${META_FILE})`);
 
     // Show samples
-    console.log('\n--- Sample Southlake permits ---');
-    for (const p of southlakePermits.slice(0, 3)) {
-      console.log(`  ${p.permit_id} | ${p.type} | ${p.address} | ${p.contractor || '(no contractor)'}`);
-    }
-
-    console.log('\n--- Sample Fort Worth permits ---');
-    for (const p of fortWorthPermits.slice(0, 3)) {
-      console.log(`  ${p.permit_id} | ${p.type} | ${p.address} | ${p.contractor || '(no contractor)'}`);
-    }
+    targets.forEach(({ name }, i) => {
+      console.log(`\n--- Sample ${CITIES[name].label} permits ---`);
+      for (const p of written[i].samples) {
+        console.log(`  ${p.permit_id} | ${p.type} | ${p.address} | ${p.contractor || '(no contractor)'}`);
+      }
+    });
 
   } finally {
-    await browser.close();
+    await new Promise(resolve => output.end(resolve));
+    await closeBrowser();
   }
 }
 
-main().catch(console.error);
+if (require.main === module) {
+  main().catch(console.error);
+}
+
+module.exports = { pullSouthlake, pullFortWorth };
@@ -6,67 +6,123 @@
  * with full details including contractor information.
  */
 
-const puppeteer = require('puppeteer');
 const fs = require('fs');
 
-const DEEPSEEK_API_KEY = process.env.DEEPSEEK_API_KEY;
-
-// Call DeepSeek API
-async function callDeepSeek(prompt, maxTokens = 4000) {
-  const response = await fetch('https://api.deepseek.com/v1/chat/completions', {
-    method: 'POST',
-    headers: {
-      'Content-Type': 'application/json',
-      'Authorization': `Bearer ${DEEPSEEK_API_KEY}`
-    },
-    body: JSON.stringify({
-      model: 'deepseek-chat',
-      messages: [{ role: 'user', content: prompt }],
-      temperature: 0.1,
-      max_tokens: maxTokens
-    })
-  });
-  const data = await response.json();
-  return data.choices[0].message.content;
-}
+const { callDeepSeek, cleanHTML, extractJSON } = require('./lib/deepseek');
+const {
+  getBrowser,
+  closeBrowser,
+  DEBUG_DUMP,
+  dumpDebugHTML,
+  blockHeavyResources,
+  waitForElement,
+  gotoWithRetry,
+  afterResultsChange,
+  resultsHTML
+} = require('./lib/browser');
+const { RESULTS_SELECTOR, FINAL_DATE_SORT, applySort, readPermitLinks, waitForPermitDetail } = require('./lib/energov');
+
+// Fixed prompt prefixes. Page HTML is appended per call so the prefix stays
+// byte-identical across runs (DeepSeek caches repeated prompt prefixes).
+const EXTRACT_PROMPT = `You are extracting permit data from a Southlake, TX EnerGov portal.
 
-// Clean HTML
-function cleanHTML(html) {
-  let cleaned = html.replace(/<style[^>]*>[\s\S]*?<\/style>/gi, '');
-  cleaned = cleaned.replace(/<script[^>]*>[\s\S]*?<\/script>/gi, '');
-  cleaned = cleaned.replace(/<!--[\s\S]*?-->/g, '');
-  cleaned = cleaned.replace(/<svg[^>]*>[\s\S]*?<\/svg>/gi, '');
-  cleaned = cleaned.replace(/\s+/g, ' ');
-  return cleaned;
-}
+TASK: Extract ALL permit records visible on this page. For each permit, extract:
+- permit_id: The permit number (e.g., "BLD-24-0123")
+- address: Full street address
+- type: Permit type (e.g., "Building Residential", "Pool", "Electrical")
+- applied_date: When applied
+- issued_date: When issued
+- status: Current status
+- description: Project description
+- detail_link: The href/link to the permit detail page (look for links with GUID like #/permit/ABC123-DEF456)
 
-// Extract JSON from response
-function extractJSON(text) {
-  try {
-    return JSON.parse(text);
-  } catch (e) {
-    const jsonMatch = text.match(/```(?:json)?\s*([\s\S]*?)```/);
-    if (jsonMatch) {
-      try { return JSON.parse(jsonMatch[1].trim()); } catch (e2) {}
+IMPORTANT: Look for recent permits (2024, 2025 dates). Focus on RESIDENTIAL building permits, pool permits, remodel permits.
+
+Return JSON:
+{
+  "permits": [
+    {
+      "permit_id": "...",
+      "address": "...",
+      "type": "...",
+      "applied_date": "...",
+      "issued_date": "...",
+      "status": "...",
+      "description": "...",
+      "detail_link": "..."
     }
-    const objMatch = text.match(/\{[\s\S]*\}/);
-    if (objMatch) {
-      try { return JSON.parse(objMatch[0]); } catch (e3) {}
+  ],
+  "notes": "any observations"
+}
+
+HTML (first 150000 chars):
+`;
+
+// Permit detail page prompt prefix
+const DETAIL_PROMPT = `Extract ALL details from this permit detail page:
+
+Look for:
+- Permit number
+- Full address
+- Permit type
+- Status
+- Applied/Issued/Expires dates
+- Valuation/cost
+- Description
+
+CRITICAL - CONTACTS TABLE:
+The page has a Contacts table with columns: Type, Company, First Name, Last Name, Title, Confirmation, Billing.
+Look for aria-label attributes like:
+- aria-label="Type Applicant"
+- aria-label="Company Mosaic Building Co."
+- aria-label="First Name Michael"
+- aria-label="Last Name Fermier"
+
+Extract EVERY contact row from this table. The contractor/builder is usually "Applicant" type.
+
+Also look for:
+- Inspections scheduled/completed
+- Any fees or payments
+
+Return JSON:
+{
+  "permit_id": "...",
+  "address": "...",
+  "type": "...",
+  "status": "...",
+  "dates": {
+    "applied": "...",
+    "issued": "...",
+    "expires": "...",
+    "finalized": "..."
+  },
+  "valuation": "...",
+  "description": "...",
+  "contacts": [
+    {
+      "type": "Applicant/Contractor/Owner",
+      "company_name": "...",
+      "first_name": "...",
+      "last_name": "...",
+      "title": "..."
     }
-    return null;
-  }
+  ],
+  "inspections": [...],
+  "fees": [...],
+  "raw_fields": {}
 }
 
+HTML:
+`;
+
 async function main() {
   console.log('Southlake Permit Puller');
   console.log('=======================\n');
 
-  const browser = await puppeteer.launch({
-    headless: 'new',
-    args: ['--no-sandbox', '--disable-setuid-sandbox']
-  });
+  const browser = await getBrowser();
 
   const page = await browser.newPage();
+  await blockHeavyResources(page);
   await page.setViewport({ width: 1280, height: 900 });
   await page.setUserAgent('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36');
 
@@ -76,17 +132,16 @@ async function main() {
 
     const searchUrl = 'https://energov.cityofsouthlake.com/EnerGov_Prod/SelfService#/search?m=2&ps=10&pn=1&em=true';
 
-    await page.goto(searchUrl, { waitUntil: 'networkidle2', timeout: 60000 });
+    await gotoWithRetry(page, searchUrl, { waitUntil: 'domcontentloaded', timeout: 30000 });
 
-    // Wait for Angular to load
+    // Wait for Angular to render the search form
     console.log('Step 2: Waiting for page to fully load...');
-    await new Promise(r => setTimeout(r, 5000));
+    await waitForElement(page, '#button-Search');
 
     // Type a search for recent permits (use "2024" or "pool" to find recent activity)
     console.log('Step 3: Searching for "pool" permits...');
     try {
       await page.type('#SearchKeyword', 'pool');
-      await new Promise(r => setTimeout(r, 1000));
     } catch (e) {
       console.log('  Keyword search skipped:', e.message);
     }
@@ -96,77 +151,38 @@ async function main() {
     const searchBtn = await page.$('#button-Search');
     if (searchBtn) {
       await searchBtn.click();
-      await new Promise(r => setTimeout(r, 5000));
+      await waitForElement(page, RESULTS_SELECTOR);
     }
 
     // Step 4b: Sort by Finalized Date Descending to get most recent permits
     console.log('Step 4b: Sorting by Finalized Date (Descending)...');
     try {
-      // Set sort field to Finalized Date
-      await page.select('#PermitCriteria_SortBy', 'string:FinalDate');
-      await new Promise(r => setTimeout(r, 1000));
-
-      // Set sort direction to Descending
-      await page.select('#SortAscending', 'boolean:false');
-      await new Promise(r => setTimeout(r, 4000));
+      // Set sort field to Finalized Date and direction to Descending together
+      await afterResultsChange(page, RESULTS_SELECTOR,
+        () => page.evaluate(applySort, FINAL_DATE_SORT), 4000);
 
       console.log('  Sort applied successfully');
     } catch (e) {
       console.log(`  Sort failed: ${e.message}`);
     }
 
-    // Get the HTML with results
-    const html = await page.content();
-    const cleanedHtml = cleanHTML(html);
+    // Get the HTML with results, plus each record's permit number as shown on
+    // the page for matching the detail view later
+    const cleanedHtml = cleanHTML(await resultsHTML(page, RESULTS_SELECTOR));
+    const permitLinks = await page.evaluate(readPermitLinks, RESULTS_SELECTOR);
 
-    console.log(`Step 5: Got ${html.length} bytes, analyzing with DeepSeek...`);
+    console.log(`Step 5: Got ${cleanedHtml.length} bytes, analyzing with DeepSeek...`);
 
-    // Save debug HTML
-    fs.writeFileSync('debug_html/southlake_recent.html', html);
+    if (DEBUG_DUMP) dumpDebugHTML('southlake_recent.html', await page.content());
 
     // Ask DeepSeek to extract permits
-    const extractPrompt = `You are extracting permit data from a Southlake, TX EnerGov portal.
-
-TASK: Extract ALL permit records visible on this page. For each permit, extract:
-- permit_id: The permit number (e.g., "BLD-24-0123")
-- address: Full street address
-- type: Permit type (e.g., "Building Residential", "Pool", "Electrical")
-- applied_date: When applied
-- issued_date: When issued
-- status: Current status
-- description: Project description
-- detail_link: The href/link to the permit detail page (look for links with GUID like #/permit/ABC123-DEF456)
-
-IMPORTANT: Look for recent permits (2024, 2025 dates). Focus on RESIDENTIAL building permits, pool permits, remodel permits.
-
-Return JSON:
-{
-  "total_results": <number shown on page>,
-  "permits": [
-    {
-      "permit_id": "...",
-      "address": "...",
-      "type": "...",
-      "applied_date": "...",
-      "issued_date": "...",
-      "status": "...",
-      "description": "...",
-      "detail_link": "..."
-    }
-  ],
-  "sort_order": "what order are results in?",
-  "notes": "any observations"
-}
-
-HTML (first 150000 chars):
-${cleanedHtml.substring(0, 150000)}`;
+    const extractPrompt = EXTRACT_PROMPT + cleanedHtml.substring(0, 150000);
 
     const response = await callDeepSeek(extractPrompt);
     const data = extractJSON(response);
 
     if (data && data.permits && data.permits.length > 0) {
-      console.log(`\nFound ${data.permits.length} permits (${data.total_results} total)`);
-      console.log(`Sort order: ${data.sort_order}`);
+      console.log(`\nFound ${data.permits.length} permits`);
       console.log(`Notes: ${data.notes}\n`);
 
       // Show first 5 permits
@@ -195,67 +211,19 @@ ${cleanedHtml.substring(0, 150000)}`;
 
         console.log(`  Navigating to: ${detailUrl}`);
 
-        await page.goto(detailUrl, { waitUntil: 'networkidle2', timeout: 60000 });
-        await new Promise(r => setTimeout(r, 4000));
-
-        const detailHtml = cleanHTML(await page.content());
-        fs.writeFileSync('debug_html/southlake_permit_detail.html', await page.content());
-
-        const detailPrompt = `Extract ALL details from this permit detail page:
-
-Look for:
-- Permit number
-- Full address
-- Permit type
-- Status
-- Applied/Issued/Expires dates
-- Valuation/cost
-- Description
-
-CRITICAL - CONTACTS TABLE:
-The page has a Contacts table with columns: Type, Company, First Name, Last Name, Title, Confirmation, Billing.
-Look for aria-label attributes like:
-- aria-label="Type Applicant"
-- aria-label="Company Mosaic Building Co."
-- aria-label="First Name Michael"
-- aria-label="Last Name Fermier"
+        // Wait on the number read from the results list rather than the model's
+        // copy, which may be wrong
+        const listed = permitLinks.find(link => detailUrl.endsWith(link.detail_link));
+        const permitId = listed && listed.permit_id !== 'Unknown' ? listed.permit_id : null;
 
-Extract EVERY contact row from this table. The contractor/builder is usually "Applicant" type.
+        await gotoWithRetry(page, detailUrl, { waitUntil: 'domcontentloaded', timeout: 30000 });
+        await waitForPermitDetail(page, permitId, 15000);
 
-Also look for:
-- Inspections scheduled/completed
-- Any fees or payments
-
-Return JSON:
-{
-  "permit_id": "...",
-  "address": "...",
-  "type": "...",
-  "status": "...",
-  "dates": {
-    "applied": "...",
-    "issued": "...",
-    "expires": "...",
-    "finalized": "..."
-  },
-  "valuation": "...",
-  "description": "...",
-  "contacts": [
-    {
-      "type": "Applicant/Contractor/Owner",
-      "company_name": "...",
-      "first_name": "...",
-      "last_name": "...",
-      "title": "..."
-    }
-  ],
-  "inspections": [...],
-  "fees": [...],
-  "raw_fields": {}
-}
+        const rawDetailHtml = await page.content();
+        const detailHtml = cleanHTML(rawDetailHtml);
+        dumpDebugHTML('southlake_permit_detail.html', rawDetailHtml);
 
-HTML:
-${detailHtml.substring(0, 120000)}`;
+        const detailPrompt = DETAIL_PROMPT + detailHtml.substring(0, 120000);
 
         const detailResponse = await callDeepSeek(detailPrompt);
         const detailData = extractJSON(detailResponse);
@@ -282,7 +250,8 @@ ${detailHtml.substring(0, 120000)}`;
   } catch (error) {
     console.error('Error:', error.message);
   } finally {
-    await browser.close();
+    await page.close();
+    await closeBrowser();
   }
 }
 